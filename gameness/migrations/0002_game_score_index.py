@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gameness', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='game',
+            name='score',
+            field=models.DecimalField(db_index=True, decimal_places=3, default=0, max_digits=10, verbose_name='Point'),
+        ),
+    ]
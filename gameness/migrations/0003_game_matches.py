@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.db.models import Count, Q
+
+
+def count_matches(apps, schema_editor):
+    """
+    Fill in the match count of the games which already have matched turns
+    """
+    Game = apps.get_model('gameness', 'Game')
+    games = Game.objects.annotate(matched=Count('turns', filter=Q(turns__is_match=True))).filter(matched__gt=0)
+    for game_id, matched in games.values_list('id', 'matched'):
+        Game.objects.filter(pk=game_id).update(matches=matched)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gameness', '0002_game_score_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='game',
+            name='matches',
+            field=models.IntegerField(default=0, verbose_name='Matches'),
+        ),
+        migrations.RunPython(count_matches, migrations.RunPython.noop),
+    ]
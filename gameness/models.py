@@ -2,6 +2,7 @@
 __author__ = 'klaswikblad'
 
 from django.db import models
+from django.db.models import Count, F, Max, Min, Q
 from django.conf import settings
 
 import time
@@ -9,6 +10,8 @@ import json
 import logging
 from decimal import Decimal
 
+import orjson
+
 log = logging.getLogger(__name__)
 
 
@@ -22,15 +25,16 @@ class GameManager(models.Manager):
         """
         actives = self.filter(active=True, finished=False, player=player )
         if actives.count() > 1:
-            log.warning(f"User {player} has more than one active round.")
+            log.warning("User %s has more than one active round.", player)
         return actives.latest("created")
 
     def get_highscores(self):
         """
-        Get a list of all the scores in the contest sorted by highest score first
+        Get a list of all the scores in the contest sorted by highest score first, only loading the columns the
+        highscore list shows
         :return:
         """
-        return self.filter(active=False, finished=True).order_by("-score")
+        return self.filter(active=False, finished=True).only("id", "player", "score", "created").order_by("-score")
 
     def get_player_best_score(self, player):
         """
@@ -52,13 +56,14 @@ class GameManager(models.Manager):
         # Purge all suspected games.
         # scores = self.get_highscores().annotate(suspected_games=Count('suspects')).exclude(suspected_games__gt=0)
         winnerlist = []
-        emails = []
+        emails = set()
 
         # Distinct is not implemented in combination with annotate. so doing a poor mans version.
-        for score in scores:
+        # Iterate instead of evaluating the whole queryset, we stop reading rows as soon as the list is full.
+        for score in scores.iterator():
             if not score.player in emails:
                 winnerlist.append(score)
-                emails.append(score.player)
+                emails.add(score.player)
             if len(winnerlist) == num:
                 break
         enough_winners = bool(len(winnerlist) >= num)
@@ -89,15 +94,36 @@ class Game(models.Model):
     seed = models.CharField('Seed', max_length=100) # Random seed for generating the playfield
     player = models.EmailField() # Email address identifying the player
     created = models.DateTimeField('Created', auto_now_add=True)
-    score = models.DecimalField("Point", default=0, max_digits=10, decimal_places=3) # The calculated score after the round has been finished
+    score = models.DecimalField("Point", default=0, max_digits=10, decimal_places=3, db_index=True) # The calculated score after the round has been finished
     game_type = models.IntegerField("Game type", choices=((1, "Memory"),), default=MEMORY) # Which game type, as of now only Memory
     active = models.BooleanField("Active", default=False, null=False) # Indicates if the round is active or not
     finished = models.BooleanField("Finished", default=False, null=False) # Indicates if the player finished playing the round
     playfield = models.TextField(default="{}") # Json serialized representation of the board
     average_time = models.DecimalField("Average time for a round", default=0, max_digits=10, decimal_places=3)
+    matches = models.IntegerField("Matches", default=0) # Running count of matched turns, checked for completion
 
     objects = GameManager()
 
+    @property
+    def board(self):
+        """
+        The playfield matrix, parsed once per playfield. The parsed board is kept together with the string it was
+        parsed from, so assigning a new playfield gets it parsed again
+        :return:
+        """
+        cached = self.__dict__.get("_board")
+        if cached is None or cached[0] is not self.playfield:
+            cached = self._board = (self.playfield, orjson.loads(self.playfield))
+        return cached[1]
+
+    @property
+    def total_pairs(self):
+        """
+        The number of pairs which has to be found to finish the game
+        :return:
+        """
+        return len(self.board) * len(self.board[0]) // 2
+
     def total(self):
         return self.game_score()
 
@@ -109,16 +135,27 @@ class Game(models.Model):
         score = self.score.quantize(Decimal('0.001'))
         return score if score > 0 else 0
 
-    def calculate_score(self):
+    def turn_stats(self):
+        """
+        Collect the turn statistics needed to finish a game in a single query
+        :return: {'matches': <int>, 'total': <int>, 'first_created': <datetime>, 'last_created': <datetime>}
+        """
+        return self.turns.aggregate(matches=Count('pk', filter=Q(is_match=True)), total=Count('pk'),
+                                    first_created=Min('created'), last_created=Max('created'))
+
+    def calculate_score(self, stats=None):
         """
         Method which calculates the score based on the amount of time, clicks and errors made.
+        :param stats: Result of turn_stats(), queried if not given
         :return:
         """
+        if stats is None:
+            stats = self.turn_stats()
 
         correct_award = 150
-        turns_total = self.turns.count()
-        turns_correct = self.turns.filter(is_match=True).count()
-        seconds_left = (60.0 - (self.turns.last().created - self.turns.first().created).total_seconds()) or 0
+        turns_total = stats['total']
+        turns_correct = stats['matches']
+        seconds_left = (60.0 - (stats['last_created'] - stats['first_created']).total_seconds()) or 0
         maxpoints = turns_correct * correct_award
         deduction_for_errors = correct_award * 0.11123
 
@@ -127,6 +164,24 @@ class Game(models.Model):
 
         return Decimal(maxpoints)
 
+    def add_match(self):
+        """
+        Count a matched turn, the increment is done in the database so concurrent clicks can't lose a match and the
+        count is read back to see the matches of those clicks as well
+        :return:
+        """
+        Game.objects.filter(pk=self.pk).update(matches=F("matches") + 1)
+        self.refresh_from_db(fields=["matches"])
+
+    def finish(self):
+        """
+        Mark the game as finished and store the score, only when it's still active so a round is finished only once
+        :return: True if this call finished the game
+        """
+        self.set_finished()
+        return bool(Game.objects.filter(pk=self.pk, active=True, finished=False).update(
+            score=self.score, average_time=self.average_time, finished=self.finished, active=self.active))
+
     def set_finished(self):
         self.finished = True
         self.active = False
@@ -141,7 +196,7 @@ class Game(models.Model):
         click2 = move[1]
 
         if click1['row'] == click2['row'] and click1['column'] == click2['column']:
-            raise Exception("Corrupt move") # "Move is the same"
+            raise ValueError("Corrupt move") # "Move is the same"
 
         # Fetch the card id from playfield for the two different squares. If the id number in the two squares are the same
         # then we have a matching set of cards.
@@ -158,12 +213,10 @@ class Game(models.Model):
         :return: True/ False
         """
         if not "row" in click or not "column" in click:
-            log.warning(f"Illegal call to get_card_id with values: {click}")
+            log.warning("Illegal call to get_card_id with values: %s", click)
             return False
         else:
-            # Load the playfield matrix
-            playfield = json.loads(self.playfield)
-            return playfield[click['row']][click['column']]
+            return self.board[click['row']][click['column']]
 
     @staticmethod
     def generate_play_field(row, column, seed):
@@ -209,9 +262,9 @@ class Game(models.Model):
                     still_looking = False
             matrix[row1][column1] = pair
             matrix[row2][column2] = pair
-            log.info("Pair {} found!".format(pair))
+            log.info("Pair %s found!", pair)
         stop_time = time.time() - start_time # Check the amount of time it takes
-        log.info("Time for creating the playfield: {} s".format(stop_time))
+        log.info("Time for creating the playfield: %s s", stop_time)
         return json.dumps(matrix), stop_time
 
     def __unicode__(self):
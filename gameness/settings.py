@@ -83,6 +83,18 @@ DATABASES = {
     }
 }
 
+# Sessions are read and written on every click. With a memcached shared between the workers they are kept in the
+# cache and only fall back to the database on a miss. A per process cache would hand out stale sessions, so without
+# MEMCACHED_LOCATION the sessions stay in the database.
+if os.environ.get("MEMCACHED_LOCATION"):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+            'LOCATION': os.environ["MEMCACHED_LOCATION"],
+        }
+    }
+    SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+
 LANGUAGE_CODE = 'en-us'
 
 TIME_ZONE = 'UTC'
@@ -10,6 +10,7 @@ from gameness.models import Game, Turn, SuspectedGame
 import uuid
 import json
 import datetime
+from decimal import Decimal
 from model_mommy.mommy import make
 
 class TestCreateGameAndTurns(TestCase):
@@ -49,11 +50,8 @@ class TestCreateGameAndTurns(TestCase):
 
         # Second click
         response = self.client.post(url, data={'click': json.dumps({'row': 1, 'column': 1})})
-        response_json = response.json()
-        csrf_token = response_json['csrf_token']
         self.assertDictEqual(response.json(), {'success': True,
                                                'match': False,
-                                               'csrf_token': csrf_token,
                                                'click': [{'row': 0, 'column': 0, 'card': 0},
                                                          {'row': 1, 'column': 1, 'card': 4}]}
                              )
@@ -88,9 +86,54 @@ class TestCreateGameAndTurns(TestCase):
         self.assertFalse(Game.objects.player_has_active_games(signup))
 
         self.assertEquals(game.turns.count(), amount+1)
+        self.assertEquals(game.matches, game.total_pairs)
         print(f"The game score: {game.score}")
         self.assertTrue(game.score > 0 and game.score < 2000)
 
+    def test_illegal_clicks(self):
+        self.client.get(reverse('contest_contest'))
+        url = reverse('contest_game_view')
+
+        for click in ['not json', json.dumps([0, 0]), json.dumps({'row': 5, 'column': 0}),
+                      json.dumps({'row': 0, 'column': -1})]:
+            response = self.client.post(url, data={'click': click})
+            self.assertEquals(response.status_code, 400)
+            self.assertFalse(response.json()['success'])
+
+        response = self.client.post(url, data={'click': json.dumps({'row': 0, 'column': 0})})
+        self.assertEquals(response.status_code, 200)
+        response = self.client.post(url, data={'click': json.dumps({'row': 0, 'column': 0})})
+        self.assertEquals(response.status_code, 400)
+
+        # The first click of the turn is still held, so the turn can be finished on another square
+        response = self.client.post(url, data={'click': json.dumps({'row': 1, 'column': 0})})
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(len(response.json()['click']), 2)
+        self.assertEquals(Turn.objects.count(), 1)
+
+    def test_replayed_pair(self):
+        self.client.get(reverse('contest_contest'))
+        game = Game.objects.get(pk=self.client.session["game"])
+        game.playfield = json.dumps([[0, 1, 2], [0, 1, 2]])
+        game.save()
+        url = reverse('contest_game_view')
+
+        self.client.post(url, data={'click': json.dumps({'row': 0, 'column': 0})})
+        response = self.client.post(url, data={'click': json.dumps({'row': 1, 'column': 0})})
+        self.assertTrue(response.json()['match'])
+
+        # Neither card of the found pair can be played again
+        for _ in range(2):
+            for row in (0, 1):
+                response = self.client.post(url, data={'click': json.dumps({'row': row, 'column': 0})})
+                self.assertEquals(response.status_code, 400)
+                self.assertNotIn('completed', response.json())
+
+        game = Game.objects.get(pk=game.pk)
+        self.assertEquals(game.matches, 1)
+        self.assertFalse(game.finished)
+        self.assertEquals(game.turns.count(), 1)
+
     def test_finish_active_games(self):
         player = "test1@test.com"
 
@@ -134,6 +177,30 @@ class TestCreateGameAndTurns(TestCase):
         [5, 2, 0]
         """
 
+    def test_board_follows_playfield(self):
+        game = make(Game, seed=uuid.uuid4().hex, player=self.player_email, game_type=Game.MEMORY,
+                    playfield=json.dumps([[0, 1], [1, 0]]))
+        self.assertEquals(game.get_card_id({'row': 0, 'column': 1}), 1)
+
+        game.playfield = json.dumps([[0, 2, 1], [1, 2, 0]])
+        self.assertEquals(game.get_card_id({'row': 0, 'column': 1}), 2)
+        self.assertEquals(game.total_pairs, 3)
+
+    def test_concurrent_matches(self):
+        game = make(Game, seed=uuid.uuid4().hex, player=self.player_email, game_type=Game.MEMORY, active=True,
+                    finished=False, playfield=json.dumps([[0, 1], [1, 0]]))
+        other = Game.objects.get(pk=game.pk)
+
+        # Each request sees the match of the other one
+        other.add_match()
+        game.add_match()
+        self.assertEquals(game.matches, game.total_pairs)
+
+        # But only one of them finishes the round
+        self.assertTrue(game.finish())
+        self.assertFalse(other.finish())
+        self.assertFalse(Game.objects.player_has_active_games(self.player_email).exists())
+
     def test_suspected_game(self):
         player = "test1@test.com"
         game = make(Game, seed=uuid.uuid4().hex, player=player, game_type=Game.MEMORY, active=False,
@@ -148,4 +215,37 @@ class TestCreateGameAndTurns(TestCase):
         total_time = game.turns.first().created - game.turns.last().created
         game.average_time = (total_time / game.turns.count()).total_seconds()
         self.assertTrue(SuspectedGame.is_game_suspected(game))
-        self.assertEquals(game.suspects.filter(player=player).count(), 1)
\ No newline at end of file
+        self.assertEquals(game.suspects.filter(player=player).count(), 1)
+
+class TestHighscores(TestCase):
+    def test_unique_highscores(self):
+        for player, score in [("test1@test.com", 100), ("test1@test.com", 300), ("test2@test.com", 200)]:
+            make(Game, seed=uuid.uuid4().hex, player=player, game_type=Game.MEMORY, active=False, finished=True,
+                 score=score)
+
+        winners, enough_winners = Game.objects.get_unique_highscores(num=5)
+        self.assertFalse(enough_winners)
+        self.assertEquals([(game.player, game.score) for game in winners],
+                          [("test1@test.com", 300), ("test2@test.com", 200)])
+
+        session = self.client.session
+        session["player"] = "test2@test.com"
+        session.save()
+        response = self.client.get(reverse('contest_highscore'))
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(response.context["best_score"].score, 200)
+        self.assertEquals(len(response.context["unique_highscores"]), 2)
+        self.assertEquals(len(response.context["highscores"]), 3)
+
+    def test_best_score_in_game_data(self):
+        for player in settings.USER_EMAILS:
+            for score in (100, 300):
+                make(Game, seed=uuid.uuid4().hex, player=player, game_type=Game.MEMORY, active=False, finished=True,
+                     score=score)
+
+        response = self.client.get(reverse('contest_contest'))
+        game_data = json.loads(response.context["game_data"])
+        self.assertEquals(Decimal(game_data["best_score"]), 300)
+        self.assertEquals((game_data["rows"], game_data["cols"]), (2, 3))
+        self.assertEquals(game_data["name"], "Memory")
+        self.assertEquals(len(game_data["pieces"]), 10)
@@ -1,20 +1,21 @@
 # -*- coding: utf-8 -*-
-import json
 import logging
 import uuid
 
+from functools import lru_cache
+
 from decimal import Decimal
 from random import choice
 
+import orjson
 from django.conf import settings
 from django.contrib.staticfiles.templatetags.staticfiles import static
-from django.core.serializers.json import DjangoJSONEncoder
-from django.http import JsonResponse
-from django.utils.encoding import smart_text
+from django.db.models import Max
+from django.http import HttpResponse
 from django.views import View
-from django.views.generic.base import ContextMixin, TemplateView
+from django.views.generic.base import TemplateView
 
-from gameness.models import Game
+from gameness.models import Game, SuspectedGame, Turn
 
 log = logging.getLogger(__name__)
 
@@ -24,7 +25,74 @@ def aquire_csrf(request):
     return csrf(request)
 
 
-class ContestGameView(View, ContextMixin):
+@lru_cache(maxsize=1)
+def game_assets():
+    """
+    The static urls of the game assets, they don't change during the lifetime of the process so they are resolved once
+    :return:
+    """
+    return {
+        "pieces": [static(f"img/memory/stack/{i}.jpg") for i in range(1, 11)],
+        "backPiece": static("img/memory/card-backside-default.png"),
+        "font_url": static("games/fonts/press-start-2p.css"),
+        "audio_win": static("games/sfx/memory-win.wav"),
+        "audio_hit": static("games/sfx/memory-hit.wav"),
+        "audio_miss": static("games/sfx/memory-miss.wav")
+    }
+
+
+@lru_cache(maxsize=1)
+def game_data_template():
+    """
+    The serialized constant part of the game data, without the closing brace so the per request fields can be appended
+    :return:
+    """
+    game_data = {"success": True, "name": "Memory", "font_family": "Press Start 2P"}
+    game_data.update(game_assets())
+    return orjson.dumps(game_data)[:-1]
+
+
+def orjson_default(obj):
+    """
+    Serialize the types orjson does not handle natively, the same way DjangoJSONEncoder would
+    :param obj:
+    :return:
+    """
+    if isinstance(obj, Decimal):
+        return str(obj)
+    raise TypeError
+
+
+def parse_click(game, raw, matched=()):
+    """
+    Decode a reported click and check that it targets a square on the playfield which is still in play
+    :param game: Game object
+    :param raw: Json serialized click {'row': y, 'column': x}
+    :param matched: Card ids of the pairs which already have been found
+    :return: The click as a dict
+    :raises ValueError: If the click is malformed, outside the playfield or on a card which already has been matched
+    """
+    click = orjson.loads(raw)
+    if not isinstance(click, dict) or not all(type(click.get(key)) is int for key in ("row", "column")):
+        raise ValueError(f"Malformed click {raw}")
+    if not (0 <= click["row"] < len(game.board) and 0 <= click["column"] < len(game.board[0])):
+        raise ValueError(f"Click outside the playfield {raw}")
+    if game.board[click["row"]][click["column"]] in matched:
+        raise ValueError(f"Click on an already matched card {raw}")
+    return click
+
+
+class ORJsonResponse(HttpResponse):
+    """
+    Drop in replacement for JsonResponse serializing with orjson.
+    """
+
+    def __init__(self, data, **kwargs):
+        kwargs.setdefault("content_type", "application/json")
+        super(ORJsonResponse, self).__init__(content=orjson.dumps(data, default=orjson_default), **kwargs)
+
+
+class ContestGameView(View):
     """
     Non visible view, gathers data during the time the games are played.
     """
@@ -47,14 +115,14 @@ class ContestGameView(View, ContextMixin):
                  If the game is completed, then return {'success': True, 'completed': True, 'score': <score>}
         """
 
-        if not "game" in request.session:
+        session = request.session
+        if not "game" in session:
             log.warning("Game id not found in session, severe error.")
-            return JsonResponse({'success': False}, status=500)
+            return ORJsonResponse({'success': False}, status=500)
 
         context = {"success": True}
-        context.update(aquire_csrf(self.request))
-        player = request.session["player"]
-        game_id = request.session['game']
+        player = session["player"]
+        game_id = session['game']
 
         # Basic instructions
         # Extract the click being reported
@@ -63,34 +131,57 @@ class ContestGameView(View, ContextMixin):
         # Check if there is a match if second click and save it
 
         try:
-            game = Game.objects.get(pk=game_id, player=player, active=True, finished=False)
+            # Every click needs the playfield and the match count, the rest of the columns are only ever written when
+            # the round finishes
+            game = Game.objects.only("id", "player", "playfield", "matches").get(pk=game_id, player=player,
+                                                                                  active=True, finished=False)
         except Game.DoesNotExist:
             context = {"success": False, "msg": "No active game session found."}
 
-            log.info(
-                f"User: {player} There is no active game associated with this session or the game in the session does not exists {game_id}.")
-            return JsonResponse(context, status=404)
+            log.info("User: %s There is no active game associated with this session or the game in the session does not "
+                     "exists %s.", player, game_id)
+            return ORJsonResponse(context, status=404)
 
-        # Part 1: Insert code here
-
-
-
-        # Part 2: Check if the game has been finished and ifso,
-            # Calculate a score save it to Game.score, see class methods
-            # Fill in any relevant variables in the Game class
-            # Finish the game off with cleaning up variables and call Game.set_finished()
-            # Check whether the game was considered Suspected with the SuspectedGame class
-            # if the Game is finished, return according to method documentation above
-
-        if self.game_completed(game):
-            request.session.pop("game")
-            # Insert code here
-
-        # Don't forget to update the csrf token
-        if "csrf_token" in context.keys():
-            context.update({"csrf_token": smart_text(context["csrf_token"])})
-
-        return JsonResponse(context)
+        matched = session.get("matched", [])
+        try:
+            click = parse_click(game, request.POST.get("click", ""), matched)
+        except ValueError as e:
+            log.info("User: %s Illegal click in game %s: %s", player, game_id, e)
+            return ORJsonResponse({"success": False, "msg": "Illegal click."}, status=400)
+
+        if "click" not in session:
+            # First click of the turn, reveal the card and hold on to it until the second click arrives
+            click.update({'card': game.get_card_id(click)})
+            session["click"] = click
+            context["click"] = [click]
+        else:
+            try:
+                move, is_match = game.match([session["click"], click])
+            except ValueError:
+                # Same square clicked twice, keep the first click of the turn around
+                return ORJsonResponse({"success": False, "msg": "Illegal move."}, status=400)
+            session.pop("click")
+            Turn.objects.create(game=game, meta=orjson.dumps({'click': move}).decode(), is_match=is_match)
+            context.update({"click": move, "match": is_match})
+
+            if is_match:
+                # Remember the pair so it can't be matched again to finish the round
+                session["matched"] = matched + [move[0]['card']]
+                game.add_match()
+
+            if self.game_completed(game):
+                session.pop("game")
+                session.pop("matched", None)
+                stats = game.turn_stats()
+                game.score = game.calculate_score(stats)
+                game.average_time = Decimal(
+                    (stats['last_created'] - stats['first_created']).total_seconds() / stats['total'])
+                # A concurrent click may already have finished the round
+                if game.finish():
+                    SuspectedGame.is_game_suspected(game)
+                    context.update({"completed": True, "score": game.game_score()})
+
+        return ORJsonResponse(context)
 
     def game_completed(self, game):
         """
@@ -98,60 +189,54 @@ class ContestGameView(View, ContextMixin):
         :param game: Game object
         :return: True/False whether the game is finished or not
         """
-        return None
+        return game.matches >= game.total_pairs
 
 class ContestView(TemplateView):
     """
     Loads the page with the game on it. Doing basic initialization of the game.
     """
     template_name = "contest.html"
+    dimensions = (2, 3) # Rows and columns of the playfield
 
     def get_context_data(self, **kwargs):
         context = super(ContestView, self).get_context_data(**kwargs)
         player = choice(settings.USER_EMAILS)
         context["player"] = self.request.session["player"] = player
-        self.request.session["game_id"] = uuid.uuid4().hex
+        # One uuid per page load, it both identifies the round in the session and seeds the playfield
+        seed = self.request.session["game_id"] = uuid.uuid4().hex
         context.update(aquire_csrf(self.request))
 
         Game.objects.stop_active_games_for_player(player)
 
         if "game" in self.request.session:
             game_id = self.request.session.pop("game", None)
-            log.warning(f"Found existing game in session, removing: {game_id}")
+            log.warning("Found existing game in session, removing: %s", game_id)
 
         if "click" in self.request.session:
             click = self.request.session.pop("click", None)
-            log.warning(f"Found existing click in session, removing: {click}")
+            log.warning("Found existing click in session, removing: %s", click)
 
-        seed = uuid.uuid4().hex
-        dimensions = list(map(int, "2x3".split("x")))
+        rows, cols = self.dimensions
         game = Game.objects.create(player=player, active=True, finished=False, game_type=Game.MEMORY, seed=seed,
-                                   playfield=Game.generate_play_field(dimensions[0], dimensions[1], seed)[0])
+                                   playfield=Game.generate_play_field(rows, cols, seed)[0])
         self.request.session["game"] = game.pk
-        context.update(self.get_game_context(dimensions))
+        self.request.session["matched"] = []
+        context.update(self.get_game_context(self.dimensions))
 
         return context
 
     def get_game_context(self, dimensions):
         context = {}
         game_name = "Memory"
-        high_score_game = Game.objects.filter(player=self.request.session["player"], score__gt=0.0).order_by(
-            "score").first()
+        best_score = Game.objects.filter(player=self.request.session["player"], score__gt=0).aggregate(
+            best=Max("score"))["best"]
         game_data = {
-            "success": True,
-            "name": "Memory",
-            "best_score": high_score_game.score if high_score_game else Decimal("0.0"),
+            "best_score": best_score or Decimal("0.0"),
             "rows": dimensions[0],
             "cols": dimensions[1],
-            "pieces": [static(f"img/memory/stack/{i}.jpg") for i in range(1, 11)],
-            "backPiece": static("img/memory/card-backside-default.png"),
-            "font_url": static("games/fonts/press-start-2p.css"),
-            "font_family": "Press Start 2P",
-            "audio_win": static("games/sfx/memory-win.wav"),
-            "audio_hit": static("games/sfx/memory-hit.wav"),
-            "audio_miss": static("games/sfx/memory-miss.wav")
         }
-        context["game_data"] = json.dumps(game_data, cls=DjangoJSONEncoder)
+        # Only the per request fields are serialized, spliced onto the cached constant part
+        context["game_data"] = (game_data_template() + b"," + orjson.dumps(game_data, default=orjson_default)[1:]).decode()
         context["game_name"] = game_name
         return context
 
@@ -167,6 +252,6 @@ class ContestHighscoreView(TemplateView):
         context = super(ContestHighscoreView, self).get_context_data(**kwargs)
         context["player"] = self.request.session["player"]
         context["best_score"] = Game.objects.get_player_best_score(context["player"])
-        context["highscores"] = Game.objects.get_highscores()[:5]
-        context["unique_highscores"], _ = Game.objects.get_unique_highscores()[:5]
+        context["highscores"] = list(Game.objects.get_highscores()[:5])
+        context["unique_highscores"], _ = Game.objects.get_unique_highscores(num=5)
         return context